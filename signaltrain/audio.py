@@ -3,24 +3,36 @@
 __author__ = 'S.H. Hawley'
 
 # imports
+from functools import lru_cache
+import math
 import numpy as np
 import scipy.signal as scipy_signal
 import torch
 #import torchaudio
 import librosa
-from numba import autojit, njit, jit   # Note: nopython version gives symbol errors when used w/ Jupyter Notebook, so using autojit instead
+from numba import njit, prange   # autojit is gone from numba >= 0.44; everything here compiles nopython
 import os
 import sys
 import glob
+import collections
+import fractions
 #import io_methods
 from scipy.io import wavfile
 import configparser  # for reading file-based effect datasets
 import warnings
 
+try:                     # numpy >= 1.20 encodes the stride-tricks boilerplate safely
+    from numpy.lib.stride_tricks import sliding_window_view as _sliding_window_view
+except ImportError:      # older numpy: sliding_window falls back to as_strided
+    _sliding_window_view = None
+
+# One PCG64 generator for the module: the legacy np.random.* globals lock on every
+# call (bad news across DataLoader workers) and run slower Mersenne-Twister paths
+_rng = np.random.default_rng()
+
 def random_ends(size=1): # probabilty dist. that emphasizes boundaries
-    return np.random.beta(0.8,0.8,size=size)
+    return _rng.beta(0.8,0.8,size=size)
 
-@autojit
 def sliding_window(x, size, overlap=0):
     """
     Stacks 1D array into a series of sliding windows with a certain amount of overlaps.
@@ -43,6 +55,10 @@ def sliding_window(x, size, overlap=0):
     if remainder != 0:
         x = np.pad(x, (0,step-remainder), mode='constant') # pad end with zeros until it does. note this changes the size of x
 
+    if _sliding_window_view is not None:
+        # zero-alloc view with the stride arithmetic handled (and checked) by numpy
+        return _sliding_window_view(x, size, axis=-1)[..., ::step, :]
+
     nwin = (x.shape[-1]-size)//step + 1  # this truncates any leftover rows, rather than padding with zeros
     shape = x.shape[:-1] + (nwin, size)
     strides = x.strides[:-1] + (step*x.strides[-1], x.strides[-1])
@@ -64,7 +80,12 @@ def undo_sliding_window(x, overlap, flatsize=None):
     NOTE: only undoes padding that might have occurred if flatsize != None.
     """
     if overlap != 0:
-        xnew =  np.concatenate( (x[0,0:overlap],  x[:,overlap:].flatten() ) )
+        # copy straight into the output instead of flatten()+concatenate, which would
+        # materialize the flattened tail once and then copy it a second time
+        tail = x[:, overlap:]
+        xnew = np.empty(overlap + tail.size, dtype=x.dtype)
+        xnew[0:overlap] = x[0, 0:overlap]
+        np.copyto(xnew[overlap:].reshape(tail.shape), tail)  # handles strided views too
         if flatsize is not None:
           return xnew[0:flatsize]
         else:
@@ -72,10 +93,13 @@ def undo_sliding_window(x, overlap, flatsize=None):
     else:
         return x
 
-def normish(y, amp_range=None, randfunc=np.random.rand):
+def normish(y, amp_range=None, randfunc=None):
     """
     Keep signal from exceeding -1,1...but still have random amplitude
     """
+    # resolve the default at call time, not at import: worker_init() rebinds _rng
+    # per DataLoader worker, and a default bound at import would never see that
+    if randfunc is None: randfunc = _rng.random
     amp_range = [0.6, 0.9] if amp_range is None else amp_range
     y = y/np.max(np.abs(y)) * ((amp_range[1]-amp_range[0])*randfunc()+amp_range[0])
     return y
@@ -88,29 +112,31 @@ def pinknoise(N):
       N = length of array to generate
     """
     N_f = N //2 + 1
-    noise = 2*np.random.random(N_f)-1
+    noise = 2*_rng.random(N_f)-1
     s = np.sqrt(np.arange(len(noise)) + 1.)  # +1 avoids dividing by zero
     y = (np.fft.irfft(noise / s)).real
-    return y/np.max(np.abs(y))  # normalize
-
-def randsine(t, randfunc=np.random.rand, amp_range=[0.2,0.9], freq_range=[5,150], n_tones=None, t0_fac=None):
-    y = np.zeros(t.shape[0])
-    if n_tones is None: n_tones=np.random.randint(1,3)
-    for i in range(n_tones):
-        amp = amp_range[0] + (amp_range[1]-amp_range[0])*randfunc()
-        freq = freq_range[0] + (freq_range[1]-freq_range[0])*randfunc()
-        t0 = randfunc() * t[-1] if t0_fac is None else t0_fac*t[-1]
-        y += amp*np.cos(freq*(t-t0))
+    return (y/np.max(np.abs(y))).astype(np.float32, copy=False)  # normalize
+
+def randsine(t, randfunc=None, amp_range=[0.2,0.9], freq_range=[5,150], n_tones=None, t0_fac=None):
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
+    t = t.astype(np.float32, copy=False)  # audio is float32 downstream; float64 here is 2x the bandwidth
+    if n_tones is None: n_tones=_rng.integers(1,3)
+    # all tones in one broadcasted cos: (n_tones,1) params against t, summed over tones
+    amp = amp_range[0] + (amp_range[1]-amp_range[0])*randfunc(n_tones).astype(np.float32)[:, None]
+    freq = freq_range[0] + (freq_range[1]-freq_range[0])*randfunc(n_tones).astype(np.float32)[:, None]
+    t0 = t[-1] * (randfunc(n_tones).astype(np.float32)[:, None] if t0_fac is None else t0_fac)
+    y = (amp*np.cos(freq*(t - t0))).sum(axis=0)
     return normish(y, randfunc=randfunc)
 
-def box(t, randfunc=np.random.rand, t0_fac=None, delta=None):
+def box(t, randfunc=None, t0_fac=None, delta=None):
     """
     classic "box"-shaped step response
     t0_fac: specifies faction of total length at which to start at (otherwise random)
     """
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
     height_bgn, height_mid, height_end = 0.15*randfunc(), 0.35*randfunc()+0.6, 0.2*randfunc()+0.1
     maxi = len(t)
-    delta = 0 # np.random.choice([0, np.random.randint(100) ]) if delta is None else delta # maybe slope the sides ; delta=0 is an immediate step response
+    delta = 0 # _rng.choice([0, _rng.integers(100) ]) if delta is None else delta # maybe slope the sides ; delta=0 is an immediate step response
     i_up = delta+int( 0.3*randfunc() * maxi) if t0_fac is None else int(t0_fac*maxi)
     i_dn = min( i_up + int( (0.3+0.35*randfunc())*maxi), maxi-delta-1)   # time for jumping back down
     x = height_end*np.ones(t.shape[0]).astype(t.dtype, copy=False)  # unit amplitude
@@ -121,38 +147,47 @@ def box(t, randfunc=np.random.rand, t0_fac=None, delta=None):
         x[i_dn-delta:i_dn+delta] = height_mid - (height_mid-height_end)*(np.arange(2*delta))/2/delta
     return x
 
-def expdecay(t, randfunc=np.random.rand, t0_fac=None, high_fac=None, low_fac=None):
+def expdecay(t, randfunc=None, t0_fac=None, high_fac=None, low_fac=None):
     """generic exponential decay envelope; called by other routines (below)
        t0_fac is fraction of final time at which to start
     """
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
+    t = t.astype(np.float32, copy=False)
     t0 = 0.35*randfunc()*t[-1] if t0_fac is None else t0_fac*t[-1]
     height_high = 0.35*randfunc() + 0.6 if high_fac is None else high_fac
     height_low = 0.1*randfunc()+0.1 if low_fac is None else low_fac
     decay = 12*randfunc()
     x = np.exp(-decay * (t-t0)) * height_high   # decaying envelope
-    x[np.where(t < t0)] = height_low   # without this, it grow exponentially 'to the left'
+    # t is monotone, so the t<t0 region is the contiguous front: slice-assign
+    # instead of np.where, which allocates an index array just to do a memset
+    x[:np.searchsorted(t, t0)] = height_low   # without this, it grow exponentially 'to the left'
     return x
 
-def pluck(t, randfunc=np.random.rand, freq_range=[50,6400], n_tones=None, t0_fac=None, amp=None):
-    y = np.zeros(t.shape[0])
+def pluck(t, randfunc=None, freq_range=[50,6400], n_tones=None, t0_fac=None, amp=None):
     """ supposed to be like a plucked string; but with a few random tones as well"""
-    if n_tones is None: n_tones=np.random.randint(1,4)
-    for i in range(n_tones):
-        amp0 = (0.45 * randfunc() + 0.5) * np.random.choice([-1, 1]) if amp is None else amp
-        t0 = (2. * randfunc()-1)*0.3 * t[-1] if t0_fac is None else t0_fac*t[-1] # for phase
-        freq = freq_range[0] + (freq_range[1]-freq_range[0])*randfunc()
-        y += amp0*np.sin(freq * (t-t0))
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
+    t = t.astype(np.float32, copy=False)
+    if n_tones is None: n_tones=_rng.integers(1,4)
+    # all tones via one broadcasted sin, as in randsine
+    if amp is None:
+        amp0 = ((0.45*randfunc(n_tones) + 0.5) * _rng.choice([-1, 1], size=n_tones)).astype(np.float32)[:, None]
+    else:
+        amp0 = np.full((n_tones, 1), amp, dtype=np.float32)
+    t0 = t[-1] * (((2.*randfunc(n_tones)-1)*0.3).astype(np.float32)[:, None] if t0_fac is None else t0_fac) # for phase
+    freq = freq_range[0] + (freq_range[1]-freq_range[0])*randfunc(n_tones).astype(np.float32)[:, None]
+    y = (amp0*np.sin(freq * (t - t0))).sum(axis=0)
     y =  y * expdecay(t, t0_fac=t0_fac)
     return normish(y, randfunc=randfunc)
 
 
-def ampexpstepup(t, randfunc=np.random.rand, freq=None, freq_range=[400,5000], start_dB=-40):
+def ampexpstepup(t, randfunc=None, freq=None, freq_range=[400,5000], start_dB=-40):
     """ sine wave with exponentially increase amplitude
     cf. Figure 3 of AES Conf Paper 6849: "Parameter Estimation of Dynamic Range Compressors: Models, Procedures and Test Signals"
     http://www.aes.org/e-lib/browse.cfm?elib=13653
     ...except we typically won't do a signal that long (theirs is ~120 seconds)
     ...Looks lik they stey by 1dB for about 50 steps across the clip
     """
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
     env_dB = np.floor( np.linspace(start_dB, 0, num=len(t)) ) # envelope in integer steps from start_dB to 0dB
     env = np.power(10.0, env_dB/10)                      # envelope in float values
     if freq is None:  #  Otherwise, the user has specified a frequency in Hz
@@ -161,9 +196,10 @@ def ampexpstepup(t, randfunc=np.random.rand, freq=None, freq_range=[400,5000], s
     return normish(y, randfunc=randfunc)
 
 
-def sweep(t, randfunc=np.random.rand, freq_range=[20,20000], amp=None, amp_too=False):
+def sweep(t, randfunc=None, freq_range=[20,20000], amp=None, amp_too=False):
     """exponential frequency sweep
     """
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
     tmax = t[-1]
     lnfr = np.log(freq_range[1]/freq_range[0])  # ln of frequency ratio
     amp = 0.9*randfunc() if amp is None else amp
@@ -172,26 +208,31 @@ def sweep(t, randfunc=np.random.rand, freq_range=[20,20000], amp=None, amp_too=F
         y *= np.exp(lnfr*t/tmax)
     return normish(y, randfunc=randfunc)
 
-def spikes(t, n_spikes=50, randfunc=np.random.rand):  # "bunch of random spikes"
-    x = np.zeros(t.shape[0])
-    for i in range(n_spikes):   # arbitrarily make a 'spike' somewhere, surrounded by silence
-      loc = int( int(randfunc()*len(t)-2)+1* t[-1] )
-      height = (2*randfunc()-1)*0.7    # -0.7...0.7
-      x[loc] = height
-      x[loc+1] = height/2  # widen the spike a bit
-      x[loc-1] = height/2
+def spikes(t, n_spikes=50, randfunc=None):  # "bunch of random spikes"
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
+    x = np.zeros(t.shape[0], dtype=np.float32)
+    # arbitrarily make 'spikes' here & there, surrounded by silence. scatter them all
+    # at once instead of a Python loop (also fixes the old loop's garbled location math)
+    locs = _rng.integers(1, len(t)-1, size=n_spikes)
+    heights = (2*randfunc(n_spikes)-1)*0.7    # -0.7...0.7
+    x[locs] = heights
+    x[locs+1] = heights/2  # widen the spikes a bit
+    x[locs-1] = heights/2
 
     amp_n = 0.1*randfunc()
-    x = x + amp_n*np.random.normal(size=t.shape[0])    # throw in noise
+    x = x + amp_n*_rng.standard_normal(t.shape[0], dtype=np.float32)    # throw in noise
     return x
 
-def triangle(t, randfunc=np.random.rand, t0_fac=None): # ramp up then down
-    height = (0.4 * randfunc() + 0.4) * np.random.choice([-1,1])
+def triangle(t, randfunc=None, t0_fac=None): # ramp up then down
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
+    t = t.astype(np.float32, copy=False)
+    height = (0.4 * randfunc() + 0.4) * _rng.choice([-1,1])
     width = randfunc()/4 * t[-1]     # half-width actually
     t0 = 2*width + 0.4 * randfunc()*t[-1] if t0_fac is None else t0_fac*t[-1]
     x = height * (1 - np.abs(t-t0)/width)
-    x[np.where(t < (t0-width))] = 0
-    x[np.where(t > (t0+width))] = 0
+    # monotone t: both masked regions are contiguous ends, so zero by slice
+    x[:np.searchsorted(t, t0-width)] = 0
+    x[np.searchsorted(t, t0+width, side='right'):] = 0
     amp_n = (0.1*randfunc()+0.02)   # add noise
     return x + amp_n*pinknoise(t.shape[0])
 
@@ -217,7 +258,9 @@ def read_audio_file(filename, sr=44100, mono=True, norm=False, device='cpu', dty
     with warnings.catch_warnings(record=True) as w:
         warnings.simplefilter("error")    # scipy throws warnings which should be errors
         try:
-            out_sr, signal = wavfile.read(filename)
+            # mmap gives a lazy view: only pages actually touched get read from disk,
+            # which is a big win when callers slice small windows out of long files
+            out_sr, signal = wavfile.read(filename, mmap=True)
             scipy_ok = True
         except wavfile.WavFileWarning:
             if warn:
@@ -231,8 +274,9 @@ def read_audio_file(filename, sr=44100, mono=True, norm=False, device='cpu', dty
             signal = np.array(signal/32767.0, dtype=dtype)   # change from [-32767..32767] to [-1..1]
 
         if out_sr != int(sr):
-            print(f"read_audio_file: Got sample rate of {rate} Hz instead of {sr} Hz requested. Resampling.")
-            signal = librosa.resample(signal, rate*1.0, sr*1.0, res_type='kaiser_fast')
+            print(f"read_audio_file: Got sample rate of {out_sr} Hz instead of {sr} Hz requested. Resampling.")
+            signal = librosa.resample(np.asarray(signal, dtype=dtype), out_sr*1.0, sr*1.0, res_type='kaiser_fast')
+            out_sr = int(sr)
 
     else:                                         # try librosa; it's slower but general
         if warn:
@@ -258,8 +302,24 @@ def write_audio_file(filename, data, sr=44100):
     #torchaudio.save(filename, torch.Tensor(data).unsqueeze(1), sr)
     return
 
+# readaudio_generator revisits files often (np.random.choice), so keep recently
+# read ones around rather than re-decoding the WAV on every switch
+_WAV_CACHE = collections.OrderedDict()
+_WAV_CACHE_MAX = 64
+
+def _read_audio_file_cached(filename, sr=44100, mono=True, norm=False):
+    try:
+        data, sr = _WAV_CACHE.pop(filename)       # pop & re-insert = move to MRU end
+    except KeyError:
+        data, sr = read_audio_file(filename, sr=sr, mono=mono, norm=norm)
+        if len(_WAV_CACHE) >= _WAV_CACHE_MAX:
+            _WAV_CACHE.popitem(last=False)        # evict least-recently-used
+    _WAV_CACHE[filename] = (data, sr)
+    return data, sr
+
+
 def readaudio_generator(seq_size,  path=os.path.expanduser('~')+'/datasets/signaltrain/Val', sr=44100,
-    random_every=True, mono=True, norm=False):
+    random_every=True, mono=True, norm=False, rng=None):
     """
     reads audio from any number of audio files sitting in directory 'path'
     supplies a window of length "seconds". If random_every=True, this window will be randomly chosen
@@ -268,19 +328,22 @@ def readaudio_generator(seq_size,  path=os.path.expanduser('~')+'/datasets/signa
     # basepath = directory containing Train, Val, and Test directories
     # path = audio files for dataset  (can be Train, Val or test)
     # random_every = get a random window every time next is called, or step sequentially through file
+    # rng = optional per-worker np.random.Generator, so DataLoader workers don't share one stream
+    if rng is None:
+        rng = _rng
     files = glob.glob(path+"*.wav")
     read_new_file = True
     start = -seq_size
     while True:
         if read_new_file:
-            filename = np.random.choice(files)  # pick a random audio file in the directory
+            filename = rng.choice(files)  # pick a random audio file in the directory
             #print("Reading new data from "+filename+" ")
-            data, sr = read_audio_file(filename, sr=sr, mono=mono, norm=norm)
+            data, sr = _read_audio_file_cached(filename, sr=sr, mono=mono, norm=norm)
             read_new_file=False   # don't keep switching files  everytime generator is called
 
 
         if (random_every): # grab a random window of the signal
-            start = np.random.randint(0,data.shape[0]-seq_size)
+            start = rng.integers(0,data.shape[0]-seq_size)
         else:
             start += seq_size
         xraw = data[start:start+seq_size]   # the newaxis just gives us a [1,] on front
@@ -290,17 +353,18 @@ def readaudio_generator(seq_size,  path=os.path.expanduser('~')+'/datasets/signa
             read_new_file = rc
 
 
-def synth_input_sample(t, chooser=None, randfunc=np.random.rand, t0_fac=None):
+def synth_input_sample(t, chooser=None, randfunc=None, t0_fac=None):
     """
     Synthesizes one instance from various 'fake' audio wave forms -- synthetic data
     """
+    if randfunc is None: randfunc = _rng.random   # call-time default; see normish()
     if chooser is None:
-        chooser = np.random.randint(0, 11)
+        chooser = _rng.integers(0, 11)
 
     if 0 == chooser:                     # sine, with random phase, amp & freq
         y = randsine(t, t0_fac=t0_fac)
     elif 1 == chooser:                  # noisy sine
-        y =  randsine(t,t0_fac=t0_fac) + 0.2*np.random.rand()*pinknoise(t.shape[0]) + 0.2*np.random.rand()*(2*np.random.rand(t.shape[0])-1)
+        y =  randsine(t,t0_fac=t0_fac) + 0.2*_rng.random()*pinknoise(t.shape[0]) + 0.2*_rng.random()*(2*_rng.random(t.shape[0])-1)
     elif 2 == chooser:                    #  "pluck", decaying sine wave
         y =  pluck(t,t0_fac=t0_fac)
     elif 3 == chooser:                   # ramp up then down
@@ -310,31 +374,87 @@ def synth_input_sample(t, chooser=None, randfunc=np.random.rand, t0_fac=None):
     elif 5 == chooser:                 # "bunch of spikes"
         y =  spikes(t)
     elif 6 == chooser:                # noisy box
-        y =  box(t,t0_fac=t0_fac) * (2*np.random.rand(t.shape[0])-1) # don't use pinknoise here
+        y =  box(t,t0_fac=t0_fac) * (2*_rng.random(t.shape[0])-1) # don't use pinknoise here
     elif 7 == chooser:                # noisy 'pluck'
         amp_n = (0.3*randfunc()+0.1)
         y =  pluck(t,t0_fac=t0_fac) + amp_n*pinknoise(t.shape[0])
     elif 8 == chooser:
         y =  ampexpstepup(t, start_dB=-30) # increasing amplitude-steps of sine wave
     elif 9 == chooser:                       # freq sweep
-        f_low, f_high  = np.random.randint(20,1000), np.random.randint(1000,20000)
-        amp_too = np.random.choice([False,False,True])
+        f_low, f_high  = _rng.integers(20,1000), _rng.integers(1000,20000)
+        amp_too = _rng.choice([False,False,True])
         y =  sweep(t, freq_range=[f_low, f_high], amp_too=amp_too)
     elif 10 == chooser:                     # box plus noise
-        y =  box(t) + 0.2*np.random.rand()*(2*np.random.rand(t.shape[0])-1) + 0.2*np.random.rand()*pinknoise(t.shape[0])
+        y =  box(t) + 0.2*_rng.random()*(2*_rng.random(t.shape[0])-1) + 0.2*_rng.random()*pinknoise(t.shape[0])
     elif 11 == chooser:                  # just noise
         amp_n = (0.6*randfunc()+0.2)
         y =  amp_n*pinknoise(t.shape[0])
     else:
         y =  0.5*(synth_input_sample(t)+synth_input_sample(t)) # superposition of the above
     eps = 1e-8
-    return y * np.random.choice([-1,1]) + np.random.rand(len(y))*eps # flip phase + tiny noise
+    return y * _rng.choice([-1,1]) + _rng.random(len(y))*eps # flip phase + tiny noise
+
+
+def randsine_batch(t, batch, amp_range=[0.2,0.9], freq_range=[5,150], n_tones=2, t0_fac=None):
+    """Batch of random sines, [batch, len(t)], via one broadcasted np.cos.
+       (fixed n_tones per row, unlike randsine's random 1-2)"""
+    amp = _rng.uniform(amp_range[0], amp_range[1], size=(batch, n_tones, 1))
+    freq = _rng.uniform(freq_range[0], freq_range[1], size=(batch, n_tones, 1))
+    t0 = t[-1] * (_rng.random((batch, n_tones, 1)) if t0_fac is None else t0_fac)
+    y = (amp * np.cos(freq*(t[None, None, :]-t0))).sum(axis=1)
+    # row-wise normish
+    y = y / np.max(np.abs(y), axis=1, keepdims=True)
+    return y * (0.3*_rng.random((batch, 1)) + 0.6)
+
+
+def pluck_batch(t, batch, freq_range=[50,6400], n_tones=3, t0_fac=None):
+    """Batch of 'plucks', [batch, len(t)]: broadcasted tones * broadcasted expdecay"""
+    amp = (0.45*_rng.random((batch, n_tones, 1)) + 0.5) * _rng.choice([-1., 1.], size=(batch, n_tones, 1))
+    freq = _rng.uniform(freq_range[0], freq_range[1], size=(batch, n_tones, 1))
+    t0 = t[-1] * ((2.*_rng.random((batch, n_tones, 1))-1)*0.3 if t0_fac is None else t0_fac)
+    y = (amp * np.sin(freq*(t[None, None, :]-t0))).sum(axis=1)
+    # decaying envelopes, all rows at once (mirrors expdecay())
+    t0e = t[-1] * (0.35*_rng.random((batch, 1)) if t0_fac is None else t0_fac)
+    height_high = 0.35*_rng.random((batch, 1)) + 0.6
+    height_low = 0.1*_rng.random((batch, 1)) + 0.1
+    decay = 12*_rng.random((batch, 1))
+    env = np.where(t[None, :] < t0e, height_low, np.exp(-decay*(t[None, :]-t0e))*height_high)
+    y = y * env
+    y = y / np.max(np.abs(y), axis=1, keepdims=True)
+    return y * (0.3*_rng.random((batch, 1)) + 0.6)
+
+
+def synth_input_batch(t, batch, choosers=None, t0_fac=None):
+    """
+    Batched synth_input_sample: returns [batch, len(t)] in one call.
+    The tone-sum signals (sine & pluck) are generated as whole batches with
+    broadcasting; the remaining choosers fall back to per-row generation.
+    """
+    if choosers is None:
+        choosers = _rng.integers(0, 11, size=batch)
+    choosers = np.asarray(choosers)
+    y = np.empty((batch, t.shape[0]), dtype=t.dtype)
+    rows = np.where(choosers == 0)[0]
+    if rows.size > 0:
+        y[rows] = randsine_batch(t, rows.size, t0_fac=t0_fac)
+    rows = np.where(choosers == 2)[0]
+    if rows.size > 0:
+        y[rows] = pluck_batch(t, rows.size, t0_fac=t0_fac)
+    for i in np.where((choosers != 0) & (choosers != 2))[0]:
+        y[i] = synth_input_sample(t, choosers[i], t0_fac=t0_fac)
+    return y
 #---- End test signals
 
 
 #---- Effects
-@autojit
-def compressor(x, thresh=-24, ratio=2, attackrel=0.045, sr=44100.0, dtype=np.float32):
+
+# dB <-> linear via exp/log instead of pow/log10: 10**y == exp(y*ln10) maps to the
+# cheaper (and SIMD-friendlier) exp, and 20*log10(v) == (20/ln10)*log(v) likewise
+_LN10_OVER_20 = math.log(10.0) / 20.0
+_TWENTY_OVER_LN10 = 20.0 / math.log(10.0)
+
+@njit(fastmath=True, cache=True)
+def compressor(x, thresh=-24.0, ratio=2.0, attackrel=0.045, sr=44100.0, out=None):
     """
     simple compressor effect, code thanks to Eric Tarr @hackaudio
     Inputs:
@@ -343,94 +463,209 @@ def compressor(x, thresh=-24, ratio=2, attackrel=0.045, sr=44100.0, dtype=np.flo
        ratio:    compression ratio
        attackrel:   attack & release time in seconds
        sr:       sample rate
+       out:      optional pre-allocated output buffer (len(x), same dtype), a la ufuncs
     """
-    attack = attackrel * sr  # convert to samples
-    fc = 1.0/float(attack)     # this is like 1/attack time
-    b, a = scipy_signal.butter(1, fc, analog=False, output='ba')
-    zi = scipy_signal.lfilter_zi(b, a)
-
-    dB = 20. * np.log10(np.abs(x) + 1e-6)
-    in_env, _ = scipy_signal.lfilter(b, a, dB, zi=zi*dB[0])  # input envelope calculation
-    out_env = np.copy(in_env)              # output envelope
-    i = np.where(in_env >  thresh)          # compress where input env exceeds thresh
-    out_env[i] = thresh + (in_env[i]-thresh)/ratio
-    gain = np.power(10.0,(out_env-in_env)/20)
-    y = x * gain
-    return y
+    attack = attackrel * sr    # convert to samples
+    fc = 1.0/attack            # this is like 1/attack time
 
-@jit(nopython=True)
-def my_clip_min(x, clip_min):  # does the work of np.clip(), which numba doesn't support yet
-    # TODO: keep an eye on Numba PR https://github.com/numba/numba/pull/3468 that fixes this
-    inds = np.where(x < clip_min)
-    x[inds] = clip_min
-    return x
+    # A 1st-order Butterworth lowpass is one FMA per sample, so compute its
+    # coefficients here (bilinear transform) rather than paying the SciPy
+    # butter/lfilter_zi/lfilter call overhead on every invocation
+    K = np.tan(0.5*np.pi*fc)
+    b0 = K/(K + 1.0)           # b1 == b0 for the 1-pole lowpass
+    a1 = (K - 1.0)/(K + 1.0)
+
+    N = len(x)
+    if out is None:
+        y = np.empty(N, dtype=x.dtype)
+    else:
+        y = out
+    comp_slope = 1.0/ratio - 1.0   # thresh + (e-thresh)/ratio - e == (e-thresh)*comp_slope
+    dB_prev = _TWENTY_OVER_LN10*math.log(abs(x[0]) + 1e-6)
+    env = dB_prev              # steady-state start, as lfilter_zi(b, a)*dB[0] did
+    for n in range(N):         # envelope, compression curve & gain fused in one pass
+        dB = _TWENTY_OVER_LN10*math.log(abs(x[n]) + 1e-6)
+        env = b0*(dB + dB_prev) - a1*env
+        dB_prev = dB
+        if env > thresh:       # compress where input env exceeds thresh
+            y[n] = x[n] * math.exp((env-thresh)*comp_slope*_LN10_OVER_20)
+        else:
+            y[n] = x[n]
+    return y
 
-@jit(nopython=True)
-def compressor_4controls(x, thresh=-24.0, ratio=2.0, attackTime=0.01, releaseTime=0.01, sr=44100.0):
+@njit(parallel=True, fastmath=True, cache=True)
+def compressor_4controls(x, thresh=-24.0, ratio=2.0, attackTime=0.01, releaseTime=0.01, sr=44100.0, out=None):
     """
     Thanks to Eric Tarr for MATLAB code for this, p. 428 of his Hack Audio book.  Used with permission.
     Our mods for Python:
-        Minimized the for loop, removed dummy variables, and invoked numba @jit to make this "fast"
+        Minimized the for loop, removed dummy variables, and invoked numba @njit to make this "fast"
     Inputs:
       x: input signal
       sr: sample rate in Hz
       thresh: threhold in dB
       ratio: ratio (should be >=1 , i.e. ratio:1)
       attackTime, releaseTime: in seconds
+      out: optional pre-allocated output buffer (len(x), same dtype), a la ufuncs
     """
     N = len(x)
     dtype = x.dtype
-    y = np.zeros(N, dtype=dtype)
-    lin_A = np.zeros(N, dtype=dtype)  # functions as gain
-
-    # Initialize separate attack and release times
-    alphaA = np.exp(-np.log(9)/(sr * attackTime))#.astype(dtype,copy=False)  numba doesn't support astype
-    alphaR = np.exp(-np.log(9)/(sr * releaseTime))#.astype(dtype,copy=False)
-
-    # Turn the input signal into a uni-polar signal on the dB scale
-    x_uni = np.abs(x)
-    x_dB = 20*np.log10(x_uni + 1e-8)  # x_uni casts type
-
-    # Ensure there are no values of negative infinity
-    #x_dB = np.clip(x_dB, -96, None)   # Numba doesn't yet support np.clip but we can write our own
-    x_dB = my_clip_min(x_dB, -96)
-
-    # Static Characteristics
-    gainChange_dB = np.zeros(x_dB.shape[0], dtype=dtype)
-    i = np.where(x_dB > thresh)
-    gainChange_dB[i] =  thresh + (x_dB[i] - thresh)/ratio - x_dB[i] # Perform Downwards Compression
-
-    for n in range(1, N):  # this loop is slow but not vectorizable due to its cumulative, sequential nature. @autojit makes it fast(er).
-        # smooth over the gainChange
-        if gainChange_dB[n] < lin_A[n-1]:
-            lin_A[n] = ((1-alphaA)*gainChange_dB[n]) +(alphaA*lin_A[n-1]) # attack mode
+    if out is None:
+        y = np.empty(N, dtype=dtype)
+    else:
+        y = out
+
+    # Initialize separate attack and release times (plain scalars; no dtype coercion needed)
+    alphaA = np.exp(-np.log(9)/(sr * attackTime))
+    alphaR = np.exp(-np.log(9)/(sr * releaseTime))
+
+    # Static characteristics: uni-polar dB conversion, -96 dB floor, and downwards
+    # compression all fused into one pass, rather than materializing x_uni / x_dB /
+    # clipped / where'd temporaries (each of which is another full sweep over memory)
+    gainChange_dB = np.empty(N, dtype=dtype)
+    comp_slope = 1.0/ratio - 1.0   # thresh + (d-thresh)/ratio - d == (d-thresh)*comp_slope
+    for n in prange(N):            # no cross-sample deps here, unlike the smoother below
+        d = _TWENTY_OVER_LN10*math.log(abs(x[n]) + 1e-8)
+        if d < -96.0:                   # ensure no values of negative infinity
+            d = -96.0
+        if d > thresh:
+            gainChange_dB[n] = (d - thresh)*comp_slope  # Perform Downwards Compression
         else:
-            lin_A[n] = ((1-alphaR)*gainChange_dB[n]) +(alphaR*lin_A[n-1]) # release
+            gainChange_dB[n] = 0.0
+
+    # Smooth over the gainChange & apply the resulting linear gain, one pass over memory.
+    # Keeping the running value in the scalar 'prev' (instead of re-loading lin_A[n-1])
+    # lets LLVM keep it in a register and emit tight FMA code for this sequential loop.
+    prev = 0.0
+    y[0] = x[0]     # 0 dB gain change at n=0
+    for n in range(1, N):
+        g = gainChange_dB[n]
+        a = alphaA if g < prev else alphaR      # attack vs release
+        prev = (1.0-a)*g + a*prev
+        y[n] = x[n] * math.exp(prev*_LN10_OVER_20)  # dB -> linear amplitude, fused in
 
-    lin_A = np.power(10.0,(lin_A/20))  # Convert to linear amplitude scalar; i.e. map from dB to amplitude
+    return y
 
-    y = lin_A * x    # Apply linear amplitude to input sample
 
+@njit(parallel=True, fastmath=True, cache=True)
+def _echo_kernel(x, y, delays, fracs, gains):
+    # one sweep over the signal, reading the delay taps in place -- no shifted copies;
+    # each output sample is independent, so the outer loop threads across cores
+    N = x.shape[0]
+    K = delays.shape[0]
+    for n in prange(N):
+        acc = x[n]
+        for k in range(K):
+            d = delays[k]
+            if n > d:
+                acc += gains[k] * ((1.0-fracs[k])*x[n-d] + fracs[k]*x[n-d-1])
+            elif n == d:
+                acc += gains[k] * (1.0-fracs[k]) * x[0]
+        y[n] = acc
     return y
 
 
  # this is a echo or delay function
-def echo(x, delay_samples=1487, ratio=0.6, echoes=1):
+def echo(x, delay_samples=1487, ratio=0.6, echoes=1, out=None):
     # ratio = redution ratio
-    dtype = x.dtype
-    y = np.copy(x)
-    for i in range(int(np.round(echoes))):   # note 'echoes' is a 'switch'; does not vary continuously
-        ip1 = i+1       # literally "i plus 1"
+    # out = optional pre-allocated output buffer; avoids a fresh alloc per chunk
+    # note 'echoes' is a 'switch'; does not vary continuously
+    ip1 = np.arange(1, int(np.round(echoes))+1)     # literally "i plus 1"
+    delay_lengths = ip1 * delay_samples
+    delays = np.floor(delay_lengths).astype(np.int64)
+    # fractional parts keep the delay continuously differentiable
+    fracs = (delay_lengths - delays).astype(x.dtype, copy=False)
+    gains = np.power(ratio, ip1).astype(x.dtype, copy=False)
+    y = np.empty_like(x) if out is None else out
+    return _echo_kernel(x, y, delays, fracs, gains)
+
+
+# Torch variants of the effects, batch-parallel over [B, N] tensors (CPU or CUDA).
+# When the trainer already lives on the GPU these beat looping the NumPy kernels
+# chunk by chunk; the Effect classes below pick them whenever x is a tensor.
+def compressor_4controls_torch(x, thresh: float = -24.0, ratio: float = 2.0,
+                               attackTime: float = 0.01, releaseTime: float = 0.01,
+                               sr: float = 44100.0):
+    """
+    Batched compressor_4controls on torch tensors [..., N].  The static curve is
+    elementwise; the attack/release smoother is sequential in time but runs the
+    whole batch per step.  (Annotations are for torch.jit.script, below.)
+    """
+    alphaA = math.exp(-math.log(9)/(sr * attackTime))
+    alphaR = math.exp(-math.log(9)/(sr * releaseTime))
+    x_dB = (20.0*torch.log10(x.abs() + 1e-8)).clamp_min(-96.0)
+    gainChange_dB = torch.where(x_dB > thresh, (x_dB - thresh)*(1.0/ratio - 1.0),
+                                torch.zeros_like(x_dB))
+    y = torch.empty_like(x)
+    y[..., 0] = x[..., 0]                   # 0 dB gain change at n=0
+    prev = torch.zeros_like(x[..., 0])
+    for n in range(1, x.shape[-1]):
+        g = gainChange_dB[..., n]
+        a = torch.where(g < prev, torch.full_like(g, alphaA), torch.full_like(g, alphaR))
+        prev = (1.0-a)*g + a*prev
+        y[..., n] = x[..., n] * torch.exp(prev*_LN10_OVER_20)
+    return y
+
+try:
+    # TorchScript fuses the pointwise ops and drops the per-op Python dispatch
+    # from the sequential smoother loop; fall back to eager if scripting fails
+    compressor_4controls_torch = torch.jit.script(compressor_4controls_torch)
+except Exception:
+    pass
+
+
+def echo_torch(x, delay_samples=1487, ratio=0.6, echoes=1):
+    """Batched echo on torch tensors [..., N]: sum of zero-padded shifts"""
+    N = x.shape[-1]
+    y = x.clone()
+    for i in range(int(round(echoes))):
+        ip1 = i+1
         delay_length = ip1 * delay_samples
-        delay_length_int = int(np.floor(delay_length))
-        # the following is an attempt to make the delay continuously differentiable
-        diff = delay_length - delay_length_int
-        x_delayed = ( (1-diff)*np.pad(x,(delay_length_int,0),mode='constant')[0:-delay_length_int] #shift and pad with zeros
-                        + diff*np.pad(x,(delay_length_int+1,0),mode='constant')[0:-(delay_length_int+1)])
-        y += pow(ratio, ip1) * x_delayed
+        d = int(math.floor(delay_length))
+        diff = delay_length - d
+        y += (ratio**ip1) * ((1-diff)*torch.nn.functional.pad(x, (d, 0))[..., 0:N]
+                             + diff*torch.nn.functional.pad(x, (d+1, 0))[..., 0:N])
     return y
 
 
+# rational approximations of the semitone ratios 2**(s/12), cached so resample_poly
+# gets the same small (up, down) pair -- and hence a cheap polyphase filter -- per shift.
+# Keyed on 0.01-semitone quanta (cents, ~inaudible) so the cache stays bounded while
+# the shift itself stays fractional: PitchShifter's knob is continuous.
+_PITCH_RATIOS = {}
+
+def _pitch_ratio(semitones):
+    key = int(round(semitones * 100))
+    try:
+        return _PITCH_RATIOS[key]
+    except KeyError:
+        frac = fractions.Fraction(2.0**(key/1200.0)).limit_denominator(100)
+        _PITCH_RATIOS[key] = (frac.numerator, frac.denominator)
+        return _PITCH_RATIOS[key]
+
+
+def pitch_shift(x, sr=44100, n_steps=0, n_fft=2048, hop_length=512):
+    """
+    Shift pitch by n_steps semitones (fractional values welcome): phase-vocoder
+    time stretch, then a polyphase resample back to the original duration.
+    Does the same job as librosa.effects.pitch_shift but with scipy's resample_poly
+    (with cached rational rates) in place of librosa's slow per-call kaiser resampler.
+    """
+    # quantize to the same 0.01-semitone quanta as the ratio cache, so the vocoder
+    # stretch and the resample undoing it agree exactly
+    semitones = round(float(n_steps) * 100) / 100.0
+    if semitones == 0.0:
+        return x
+    rate = 2.0**(-semitones/12.0)
+    stft = librosa.stft(x, n_fft=n_fft, hop_length=hop_length)
+    y = librosa.istft(librosa.phase_vocoder(stft, rate, hop_length=hop_length),
+                      hop_length=hop_length)
+    up, down = _pitch_ratio(-semitones)   # resample by 2**(-s/12): undoes the stretch in duration
+    y = scipy_signal.resample_poly(y, up, down).astype(x.dtype, copy=False)
+    if y.shape[0] >= x.shape[0]:          # fix length to match the input
+        return y[0:x.shape[0]]
+    out = np.zeros(x.shape[0], dtype=x.dtype)
+    out[0:y.shape[0]] = y
+    return out
 
 
 # Classes for Effects. First is the generic/main class. All others are subclass of this
@@ -475,8 +710,8 @@ class Compressor(Effect):
         self.name = 'Compressor'
         self.knob_names = ['threshold', 'ratio', 'attackreleaseTime']
         self.knob_ranges = np.array([[-30,0], [1,5], [1e-3,4e-2]])
-    def go_wc(self, x, knobs_w):
-        return compressor(x, thresh=knobs_w[0], ratio=knobs_w[1], attackrel=knobs_w[2], sr=self.sr), x
+    def go_wc(self, x, knobs_w, out=None):
+        return compressor(x, thresh=knobs_w[0], ratio=knobs_w[1], attackrel=knobs_w[2], sr=self.sr, out=out), x
 
 class Compressor_4c(Effect):  # compressor with 4 controls
     def __init__(self, **kwargs):
@@ -484,8 +719,10 @@ class Compressor_4c(Effect):  # compressor with 4 controls
         self.name = 'Compressor_4c'
         self.knob_names = ['threshold', 'ratio', 'attackTime','releaseTime']
         self.knob_ranges = np.array([[-30,0], [1,5], [1e-3,4e-2], [1e-3,4e-2]])
-    def go_wc(self, x, knobs_w):
-        return compressor_4controls(x, thresh=knobs_w[0], ratio=knobs_w[1], attackTime=knobs_w[2], releaseTime=knobs_w[3], sr=self.sr), x
+    def go_wc(self, x, knobs_w, out=None):
+        if torch.is_tensor(x):   # batched GPU/CPU tensor path
+            return compressor_4controls_torch(x, thresh=knobs_w[0], ratio=knobs_w[1], attackTime=knobs_w[2], releaseTime=knobs_w[3], sr=self.sr), x
+        return compressor_4controls(x, thresh=knobs_w[0], ratio=knobs_w[1], attackTime=knobs_w[2], releaseTime=knobs_w[3], sr=self.sr, out=out), x
 
 
 class Compressor_4c_Large(Effect):  # compressor with 4 controls, larger ranges for parameters
@@ -494,8 +731,8 @@ class Compressor_4c_Large(Effect):  # compressor with 4 controls, larger ranges
         self.name = 'Compressor_4c_Large'
         self.knob_names = ['threshold', 'ratio', 'attackTime','releaseTime']
         self.knob_ranges = np.array([[-50,0], [1.5,10], [1e-3,1], [1e-3,1]])
-    def go_wc(self, x, knobs_w):
-        return compressor_4controls(x, thresh=knobs_w[0], ratio=knobs_w[1], attackTime=knobs_w[2], releaseTime=knobs_w[3], sr=self.sr), x
+    def go_wc(self, x, knobs_w, out=None):
+        return compressor_4controls(x, thresh=knobs_w[0], ratio=knobs_w[1], attackTime=knobs_w[2], releaseTime=knobs_w[3], sr=self.sr, out=out), x
 
 
 class Comp_Just_Thresh(Effect):  # compressor with just threshold
@@ -522,8 +759,10 @@ class Echo(Effect):
         self.knob_names = ['delay_samples', 'ratio', 'echoes']
         #self.knob_ranges = np.array([[100,1500], [0.1,0.9],[2,2]])
         self.knob_ranges = np.array([[400,400], [0.4,1.0],[2,2]])
-    def go_wc(self, x, knobs_w):
-        return echo(x, delay_samples=int(np.round(knobs_w[0])), ratio=knobs_w[1], echoes=int(np.round(knobs_w[2]))), x
+    def go_wc(self, x, knobs_w, out=None):
+        if torch.is_tensor(x):   # batched GPU/CPU tensor path
+            return echo_torch(x, delay_samples=int(np.round(knobs_w[0])), ratio=knobs_w[1], echoes=int(np.round(knobs_w[2]))), x
+        return echo(x, delay_samples=int(np.round(knobs_w[0])), ratio=knobs_w[1], echoes=int(np.round(knobs_w[2])), out=out), x
 
 class PitchShifter(Effect):
     def __init__(self, **kwargs):
@@ -532,7 +771,7 @@ class PitchShifter(Effect):
         self.knob_names = ['n_steps']
         self.knob_ranges = np.array([[-12,12]])  # number of 12-tone pitch steps by which to shift the signal
     def go_wc(self, x, knobs_w):
-        return librosa.effects.pitch_shift(x, sr=self.sr, n_steps=knobs_w[0]), x   # TODO: librosa's pitch_shift is SLOW!
+        return pitch_shift(x, sr=self.sr, n_steps=knobs_w[0]), x
 
 class Denoise(Effect):  # add noise to x, swap x and y
     """
@@ -547,7 +786,7 @@ class Denoise(Effect):  # add noise to x, swap x and y
         self.knob_ranges = np.array([[0.0,0.5]])
         self.is_inverse = True
     def go_wc(self, x, knobs_w):
-        return x, x + (knobs_w[0]*(2*np.random.random(x.shape[0])-1)).astype(x.dtype, copy=False)   # swaps y & x: what was the input becomes the output
+        return x, x + (knobs_w[0]*(2*_rng.random(x.shape[0])-1)).astype(x.dtype, copy=False)   # swaps y & x: what was the input becomes the output
 
 class DeCompressor_4c(Effect):  # compressor with 4 controls
     def __init__(self):
@@ -575,17 +814,47 @@ class TimeAlign(Effect):  # add noise to x, swap x and y
         chunk_size = 4096 # TODO un-hardcode this
         self.t = np.arange(chunk_size,dtype=np.float32) / sr
     def go_wc(self, x, knobs_w):
-        chooser = np.random.choice([2,4,6,7])
+        chooser = _rng.choice([2,4,6,7])
         y = synth_input_sample(self.t, chooser, t0_fac=0.5)   # start onset in the middle of chunk
-        rand_shift = int(x.shape[0]* knobs_w[0]*(2*np.random.rand()-1)) # shift forward or back by 1/3 of width
-        x = np.roll(y,rand_shift)
-        if rand_shift > 0:
-            x[0:rand_shift] = np.zeros(rand_shift)
-        elif rand_shift < 0:
-            x[-np.abs(rand_shift):] = np.zeros(np.abs(rand_shift))
+        rand_shift = int(x.shape[0]* knobs_w[0]*(2*_rng.random()-1)) # shift forward or back by 1/3 of width
+        # np.roll would copy the whole array and wrap the very samples we zero out;
+        # one zeroed buffer + one slice copy moves only the samples that survive
+        N = y.shape[0]
+        x = np.zeros_like(y)
+        if rand_shift >= 0:
+            x[rand_shift:] = y[0:N-rand_shift]
+        else:
+            x[0:N+rand_shift] = y[-rand_shift:]
         return y, x
 
 
+@njit(cache=True, nogil=True, fastmath=True)
+def _iir_df2t(b, a, x):
+    # direct-form II transposed -- same recurrence lfilter runs, but compiled
+    # flat with nogil, skipping scipy's generic dispatch on every 4096-sample chunk
+    y = np.empty_like(x)
+    n_state = len(b) - 1
+    z = np.zeros(n_state)
+    for n in range(x.shape[0]):
+        xn = x[n]
+        yn = b[0]*xn + z[0]
+        for k in range(n_state - 1):
+            z[k] = b[k+1]*xn + z[k+1] - a[k+1]*yn
+        z[n_state-1] = b[n_state]*xn - a[n_state]*yn
+        y[n] = yn
+    return y
+
+
+@lru_cache(maxsize=4096)
+def _butter_lp(cutoff, order, sr):
+    # butter() does polynomial root-finding in Python -- costly next to the lfilter
+    # itself on a 4096-sample chunk, and the knob only spans ~2000 integer cutoffs
+    nyq = 0.5 * sr
+    normal_cutoff = cutoff / nyq
+    b, a = scipy_signal.butter(order, normal_cutoff, btype='low', analog=False)
+    return b, a
+
+
 class LowPass(Effect):
     # https://gist.github.com/junzis/e06eca03747fc194e322
     def __init__(self, sr=44100):
@@ -595,13 +864,11 @@ class LowPass(Effect):
         self.knob_ranges = np.array([[10,2000]])  # number of 12-tone pitch steps by which to shift the signal
         self.sr = sr
     def butter_lowpass(self, cutoff, order=3):
-        nyq = 0.5 * self.sr
-        normal_cutoff = cutoff / nyq
-        b, a = scipy_signal.butter(order, normal_cutoff, btype='low', analog=False)
-        return b, a
+        # round to 1 Hz so the cache actually gets hits; finer granularity is inaudible here
+        return _butter_lp(int(round(cutoff)), order, int(self.sr))
     def go_wc(self, x, knobs_w, order=3):
         b, a = self.butter_lowpass(knobs_w[0], order=order)
-        return scipy_signal.lfilter(b, a, x), x
+        return _iir_df2t(b, a, x), x
 
 
 class FileEffect(Effect):
@@ -3,34 +3,20 @@ __author__ = 'S. Venkataramani, S.I. Mimilakis'
 __copyright__ = 'ECE Illinois, MacSeNet'
 
 # imports
+from functools import lru_cache
 import numpy as np
 import torch
 import torch.nn as nn
-from torch.autograd import Variable
 from scipy.signal import cosine
+from numba import njit, prange
 
+try:                         # scipy >= 1.4 ships a fast pocketfft-backed DCT
+    from scipy.fft import dct as _scipy_dct
+except ImportError:          # older scipy: core_modulation falls back to direct cosines
+    _scipy_dct = None
 
-def core_modulation(freq_subbands, window_size):
-    """
-        Method to produce Analysis and Synthesis matrices.
-        -https://github.com/Js-Mim/ASP/
-        Arguments              :
-            freq_subbands      :   (int) Number of subbands
-            window_size        :   (int) Window size
-        Returns                :
-            Cos                :   (2D Array) Cosine Modulated Matrix
-    """
-    w = cosine(window_size)
-    # Initialize Storing Variables
-    cos_an = np.zeros((freq_subbands, window_size), dtype=np.float32)
-
-    # Generate Matrices
-    for k in xrange(0, freq_subbands):
-        for n in xrange(0, window_size):
-            cos_an[k, n] = w[n] * np.cos(np.pi / freq_subbands * (k + 0.5) *
-                                         (n + 0.5 + freq_subbands / 2)) * np.sqrt(2./freq_subbands)
-
-    return cos_an
+# decide the target device once at import, rather than poking torch attributes per call
+_DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
 
 def tied_transform(analysis, x_ft, hop):
@@ -48,12 +34,32 @@ def tied_transform(analysis, x_ft, hop):
     """
 
     sz = analysis.conv_analysis.weight.size()[0]
-    wave_form = nn.functional.conv_transpose2d(torch.transpose(x_ft, 2, 1).unsqueeze(3),
-                                               analysis.conv_analysis.weight.unsqueeze(3),
-                                               padding=(sz, 0), stride=(hop, 1))
-    return wave_form.squeeze(3)
+    wave_form = nn.functional.conv_transpose1d(torch.transpose(x_ft, 2, 1),
+                                               analysis.conv_analysis.weight,
+                                               padding=sz, stride=hop)
+    return wave_form
 
 
+@lru_cache(maxsize=16)
+def _cosine_window_f32(n):
+    """scipy's cosine() returns float64; memoize a float32 copy per window size"""
+    return cosine(n).astype(np.float32, copy=False)
+
+
+@njit(parallel=True, fastmath=True)
+def _core_modulation_nb(freq_subbands, window_size, w, out):
+    """Fused row-parallel kernel for big filter banks; avoids the multi-hundred-MB
+    broadcast temporaries the NumPy path would allocate."""
+    scale = np.sqrt(2.0 / freq_subbands)
+    c = np.pi / freq_subbands
+    half_K = freq_subbands / 2
+    for k in prange(freq_subbands):
+        kh = (k + 0.5) * c
+        for n in range(window_size):
+            out[k, n] = w[n] * np.cos(kh * (n + 0.5 + half_K)) * scale
+
+
+@lru_cache(maxsize=8)
 def core_modulation(freq_subbands, window_size):
     """
         Method to produce Analysis and Synthesis matrices.
@@ -64,37 +70,37 @@ def core_modulation(freq_subbands, window_size):
             window_size        :   (int) Window size
         Returns                :
             Cos                :   (2D Array) Cosine Modulated Polyphase Matrix
+                                   Note: cached & read-only, since Analysis & Synthesis
+                                   request the same matrix; callers copy it into weights
     """
-    w = cosine(window_size)
-
-    # just added the following profiling to compare the speed of the two methods
-    #from profilehooks import profile
-    #@profile
-    def orig_method(freq_subbands, window_size, w):
-        # Initialize Storing Variables
-        cos_an = np.zeros((freq_subbands, window_size), dtype=np.float32)
-        # Generate Matrices
-        for k in xrange(0, freq_subbands):
-            for n in xrange(0, window_size):
-                cos_an[k, n] = w[n] * np.cos(np.pi / freq_subbands * (k + 0.5) *
-                                         (n + 0.5 + freq_subbands / 2)) * np.sqrt(2. / freq_subbands)
-        return cos_an
-
-    #@profile
-    def scott_method(freq_subbands, window_size, w):
-        # Generate Matrices
+    w = _cosine_window_f32(window_size)
+
+    if (_scipy_dct is not None and window_size == 2 * freq_subbands
+            and freq_subbands % 2 == 0):
+        # The modulation cos(pi/K*(k+0.5)*(n+0.5+K/2)) is a DCT-IV basis read off
+        # with a K/2 column offset; cos symmetry about odd multiples of pi gives the
+        # mirrored/negated middle block.  One O(K^2 log K) DCT replaces K*N cosines.
+        d4 = _scipy_dct(np.eye(freq_subbands, dtype=np.float32),
+                        type=4, norm='ortho', axis=0)
+        half_K = freq_subbands // 2
+        cos_an = w * np.hstack((d4[:, half_K:], -d4[:, ::-1], -d4[:, :half_K]))
+        cos_an = cos_an.astype(np.float32, copy=False)
+    elif freq_subbands * window_size > 2**20:
+        # very large banks: fused parallel loop, no broadcast temporaries
+        cos_an = np.empty((freq_subbands, window_size), dtype=np.float32)
+        _core_modulation_nb(freq_subbands, window_size, w, cos_an)
+    else:
+        # Generate Matrices.  Broadcasting the outer product beats the old scalar double-loop
+        # (which also relied on Python-2 xrange) by orders of magnitude
+        inv_K = 1.0 / freq_subbands
         kvec = np.arange(0, freq_subbands) + 0.5
         nvec = np.arange(0, window_size) + 0.5 + freq_subbands/2
-        cos_an = w * np.cos(np.pi / freq_subbands * kvec[np.newaxis].T * nvec) * np.sqrt(2. / freq_subbands)
-        return cos_an
-
-    method = 'scott'
-    if ('scott' == method):
-        cos_an = scott_method(freq_subbands, window_size, w)
-    else:
-        cos_an = orig_method(freq_subbands, window_size, w)
-
-    return cos_an.astype(np.float32, copy=False)
+        # fold the sqrt(2/K) scale into the (short) window so the big matrix is only multiplied once
+        w_scaled = w * np.sqrt(2. * inv_K)
+        cos_an = w_scaled * np.cos((np.pi * inv_K) * kvec[np.newaxis].T * nvec)
+        cos_an = cos_an.astype(np.float32, copy=False)
+    cos_an.setflags(write=False)   # guard the cache entry against mutation
+    return cos_an
 
 
 class Analysis(nn.Module):
@@ -102,7 +108,7 @@ class Analysis(nn.Module):
         Class for building the analysis part
         of the Front-End ('Fe').
     """
-    def __init__(self, ft_size=1024, w_size=2048, hop_size=1024, shrink=False):
+    def __init__(self, ft_size=1024, w_size=2048, hop_size=1024, shrink=False, trainable=True):
         super(Analysis, self).__init__()
 
         # Parameters
@@ -111,6 +117,7 @@ class Analysis(nn.Module):
         self.sz = ft_size
         self.wsz = w_size
         self.hop = hop_size
+        self.trainable = trainable
 
         # Analysis 1D CNN
         self.conv_analysis = nn.Conv1d(1, self.sz, self.wsz,
@@ -119,18 +126,24 @@ class Analysis(nn.Module):
         # Custom Initialization with Fourier matrix
         self.initialize()
 
+        if not trainable:
+            # fixed transform: skip grad buffers & autograd bookkeeping entirely
+            for p in self.parameters():
+                p.requires_grad_(False)
+
     def initialize(self):
         fa_matrix = core_modulation(self.sz, self.wsz)
-        if torch.has_cudnn:
-            self.conv_analysis.weight.data.copy_(torch.from_numpy(fa_matrix[:, None, :]).cuda())
-        else:
-            self.conv_analysis.weight.data.copy_(torch.from_numpy(fa_matrix[:, None, :]))
+        # copy_ handles cross-device transfer; no need for a temporary GPU tensor
+        self.conv_analysis.weight.data.copy_(torch.from_numpy(fa_matrix[:, None, :]))
 
     def forward(self, wave_form):
-        wave_form = Variable(torch.from_numpy(wave_form).cuda(), requires_grad=True)
-        batch_size = wave_form.size(0)
-        time_domain_samples = wave_form.size(1)
-        wave_form = wave_form.view(batch_size, 1, time_domain_samples)
+        # plain tensor: gradients w.r.t. the input waveform are never used, and
+        # requires_grad=True forced autograd to track and store them every step
+        wave_form = torch.from_numpy(wave_form).to(_DEVICE)
+        wave_form = wave_form.unsqueeze(1)
+        if not self.trainable:
+            with torch.no_grad():
+                return torch.transpose(self.conv_analysis(wave_form), 2, 1)
         x_ft = torch.transpose(self.conv_analysis(wave_form), 2, 1)
         return x_ft
 
@@ -141,7 +154,7 @@ class Synthesis(nn.Module):
         of the Front-End ('Fe').
     """
 
-    def __init__(self, ft_size=1024, w_size=2048, hop_size=1024):
+    def __init__(self, ft_size=1024, w_size=2048, hop_size=1024, trainable=True):
         super(Synthesis, self).__init__()
 
         # Parameters
@@ -150,7 +163,8 @@ class Synthesis(nn.Module):
         self.sz = ft_size
         self.wsz = w_size
         self.hop = hop_size
-        self.half_N = int(self.sz / 2 + 1)
+        self.half_N = self.sz // 2 + 1
+        self.trainable = trainable
 
         # Synthesis 1D CNN
         self.conv_synthesis = nn.ConvTranspose1d(self.sz, 1, self.wsz,
@@ -163,18 +177,24 @@ class Synthesis(nn.Module):
         # Custom Initialization with DCT-TypeIV matrix
         self.initialize()
 
+        if not trainable:
+            # fixed transform: skip grad buffers & autograd bookkeeping entirely
+            for p in self.parameters():
+                p.requires_grad_(False)
+
     def initialize(self):
         fs_matrix = core_modulation(self.sz, self.wsz)
 
-        if torch.has_cudnn:
-            self.conv_synthesis.weight.data.copy_(torch.from_numpy(fs_matrix[:, None, :]).cuda())
-        else:
-            self.conv_synthesis.weight.data.copy_(torch.from_numpy(fs_matrix[:, None, :]))
+        self.conv_synthesis.weight.data.copy_(torch.from_numpy(fs_matrix[:, None, :]))
 
     def forward(self, x_ft):
+        sz = self.sz    # bind once; attribute lookups add up over thousands of forwards
+        if not self.trainable:
+            with torch.no_grad():
+                wave_form = self.conv_synthesis(torch.transpose(x_ft, 2, 1))
+                return wave_form[:, :, sz:-sz]
         wave_form = self.conv_synthesis(torch.transpose(x_ft, 2, 1))
-        wave_form = wave_form[:, :, self.sz:]
-        wave_form = wave_form[:, :, :-self.sz]
+        wave_form = wave_form[:, :, sz:-sz]
 
         return wave_form
 
@@ -9,12 +9,35 @@ import torch.nn as nn
 from scipy import signal as sig
 
 
+try:                         # scipy >= 1.4 ships the threaded pocketfft backend
+    from scipy.fft import fft as _scipy_fft
+
+    def fourier_basis(sz):
+        return _scipy_fft(np.eye(sz, dtype=np.float32), axis=-1, norm='ortho', workers=-1)
+except ImportError:          # older scipy: fall back to numpy
+    def fourier_basis(sz):
+        return np.fft.fft(np.eye(sz), norm='ortho')
+
+
+def dft_matrices(sz):
+    """
+    Real & imaginary parts of the (orthonormal) DFT matrix, built directly from
+    an outer product of the frequency & time indices.  Equivalent to
+    np.fft.fft(np.eye(sz), norm='ortho') but without allocating the complex
+    identity or running sz FFTs.
+    """
+    n = np.arange(sz, dtype=np.float32)
+    ang = (-2*np.pi/sz) * n[:, None] * n     # exp(-2 pi i k n / sz)
+    scale = np.float32(1.0/np.sqrt(sz))      # 'ortho' normalization
+    return scale*np.cos(ang), scale*np.sin(ang)
+
+
 class Analysis(nn.Module):
     """
         Class for building the analysis part
         of the Front-End ('Fe').
     """
-    def __init__(self, ft_size=1024, hop_size=384):
+    def __init__(self, ft_size=1024, hop_size=384, trainable=True):
         super(Analysis, self).__init__()
 
         # Parameters
@@ -22,7 +45,8 @@ class Analysis(nn.Module):
         self.time_domain_samples = None
         self.sz = ft_size
         self.hop = hop_size
-        self.half_N = int(self.sz/2. + 1)
+        self.half_N = self.sz // 2 + 1
+        self.trainable = trainable  # with fixed Fourier weights, forward can use FFT instead of conv
 
         # Analysis 1D CNN
         self.conv_analysis_real = nn.Conv1d(1, self.sz, self.sz,
@@ -30,30 +54,53 @@ class Analysis(nn.Module):
         self.conv_analysis_imag = nn.Conv1d(1, self.sz, self.sz,
                                             padding=self.sz, stride=self.hop, bias=False)
 
+        # window kept as a plain tensor (not a buffer) so old checkpoints still load
+        self._window = torch.from_numpy(sig.hamming(self.sz).astype(np.float32))
+
         # Custom Initialization with Fourier matrix
         self.initialize()
 
+        if not trainable:
+            # fixed Fourier weights: no grad buffers, and optimizers will skip them
+            for p in self.parameters():
+                p.requires_grad_(False)
+
     def initialize(self):
-        f_matrix = np.fft.fft(np.eye(self.sz), norm='ortho')
+        f_matrix = fourier_basis(self.sz)
         w = sig.hamming(self.sz)
 
         f_matrix_real = (np.real(f_matrix) * w).astype(np.float32, copy=False)
         f_matrix_imag = (np.imag(f_matrix) * w).astype(np.float32, copy=False)
 
-        if torch.has_cudnn:
-            self.conv_analysis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]).cuda())
-            self.conv_analysis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]).cuda())
-        else:
-            self.conv_analysis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]))
-            self.conv_analysis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]))
+        # copy_ handles cross-device transfer; no need for a temporary GPU tensor
+        self.conv_analysis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]))
+        self.conv_analysis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]))
+
+    def stft_forward(self, wave_form):
+        """FFT-based equivalent of the conv filter bank, O(N log N) instead of O(N*sz)"""
+        wave_form = nn.functional.pad(wave_form, (self.sz, self.sz))  # matches conv padding=self.sz
+        if hasattr(torch, 'view_as_real'):   # newer PyTorch requires return_complex for real input
+            f = torch.stft(wave_form, n_fft=self.sz, hop_length=self.hop, win_length=self.sz,
+                           window=self._window.to(wave_form.device), center=False,
+                           normalized=True, onesided=True, return_complex=True)
+            f = torch.view_as_real(f)
+        else:                                # legacy torch: real/imag already stacked in last dim
+            f = torch.stft(wave_form, n_fft=self.sz, hop_length=self.hop, win_length=self.sz,
+                           window=self._window.to(wave_form.device), center=False,
+                           normalized=True, onesided=True)
+        an_real = f[..., 0].transpose(1, 2)
+        an_imag = f[..., 1].transpose(1, 2)
+        return an_real, an_imag
 
     def forward(self, wave_form):
-        batch_size = wave_form.size(0)
-        time_domain_samples = wave_form.size(1)
+        if not self.trainable:   # weights are still the Fourier matrix, so the FFT path is exact
+            return self.stft_forward(wave_form)
 
-        wave_form = wave_form.view(batch_size, 1, time_domain_samples)
-        an_real = self.conv_analysis_real(wave_form).transpose(1, 2)[:, :, :self.half_N]
-        an_imag = self.conv_analysis_imag(wave_form).transpose(1, 2)[:, :, :self.half_N]
+        # unsqueeze is metadata-only and, unlike view, doesn't require contiguous input
+        half_N = self.half_N    # bind once; attribute lookups add up over thousands of forwards
+        wave_form = wave_form.unsqueeze(1)
+        an_real = self.conv_analysis_real(wave_form).transpose(1, 2)[:, :, :half_N]
+        an_imag = self.conv_analysis_imag(wave_form).transpose(1, 2)[:, :, :half_N]
 
         return an_real, an_imag
 
@@ -64,7 +111,7 @@ class Synthesis(nn.Module):
         of the Front-End ('Fe').
     """
 
-    def __init__(self, ft_size=1024, hop_size=384):
+    def __init__(self, ft_size=1024, hop_size=384, trainable=True):
         super(Synthesis, self).__init__()
 
         # Parameters
@@ -72,7 +119,8 @@ class Synthesis(nn.Module):
         self.time_domain_samples = None
         self.sz = ft_size
         self.hop = hop_size
-        self.half_N = int(self.sz / 2 + 1)
+        self.half_N = self.sz // 2 + 1
+        self.trainable = trainable
 
         # Synthesis 1D CNN
         self.conv_synthesis_real = nn.ConvTranspose1d(self.sz, 1, self.sz,
@@ -81,50 +129,61 @@ class Synthesis(nn.Module):
         self.conv_synthesis_imag = nn.ConvTranspose1d(self.sz, 1, self.sz,
                                                       padding=0, stride=self.hop, bias=False)
 
+        self._window = torch.from_numpy(sig.hamming(self.sz).astype(np.float32))
+
         # Custom Initialization with Fourier matrix
         self.initialize()
 
+        if not trainable:
+            # fixed Fourier weights: no grad buffers, and optimizers will skip them
+            for p in self.parameters():
+                p.requires_grad_(False)
+
     def initialize(self):
-        f_matrix = np.fft.fft(np.eye(self.sz), norm='ortho')
+        f_matrix = fourier_basis(self.sz)
         w = Synthesis.GLA(self.sz, self.hop, self.sz)
 
         f_matrix_real = (np.real(f_matrix) * w).astype(np.float32, copy=False)
         f_matrix_imag = (np.imag(f_matrix) * w).astype(np.float32, copy=False)
 
-        if torch.has_cudnn:
-            self.conv_synthesis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]).cuda())
-            self.conv_synthesis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]).cuda())
+        self.conv_synthesis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]))
+        self.conv_synthesis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]))
 
-        else:
-            self.conv_synthesis_real.weight.data.copy_(torch.from_numpy(f_matrix_real[:, None, :]))
-            self.conv_synthesis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag[:, None, :]))
+    def istft_forward(self, real, imag):
+        """Inverse-FFT equivalent of the transposed-conv filter bank.
+        istft's own overlap-add normalization takes the place of the GLA window."""
+        spec = torch.stack((real, imag), dim=-1).transpose(1, 2).contiguous()  # (batch, half_N, frames, 2)
+        if hasattr(torch, 'view_as_complex'):
+            spec = torch.view_as_complex(spec)
+        wave_form = torch.istft(spec, n_fft=self.sz, hop_length=self.hop, win_length=self.sz,
+                                window=self._window.to(real.device), center=False,
+                                normalized=True, onesided=True)
+        return wave_form[:, self.sz:-self.sz]  # trim analysis padding, as in the conv path
 
     def forward(self, real, imag):
+        if not self.trainable:
+            if hasattr(torch, 'istft'):  # istft only in newer PyTorch
+                return self.istft_forward(real, imag)
+            with torch.no_grad():        # frozen conv path: skip graph construction
+                return self._conv_forward(real, imag)
+        return self._conv_forward(real, imag)
+
+    def _conv_forward(self, real, imag):
         real = torch.transpose(real, 1, 2)
         imag = torch.transpose(imag, 1, 2)
 
-        # Hawley removed 'contiguous' with no apparent accuracy changes but a slight performance boost to flip() call
-        #real = torch.cat((real, Synthesis.flip(real[:, 1:-1, :].contiguous(), 1)), 1)
-        #imag = torch.cat((imag, Synthesis.flip(-imag[:, 1:-1, :].contiguous(), 1)), 1)
+        # flip() reads the strided slice directly, so no 'contiguous' copy is needed
         real = torch.cat((real, Synthesis.flip(real[:, 1:-1, :], 1)), 1)
         imag = torch.cat((imag, Synthesis.flip(-imag[:, 1:-1, :], 1)), 1)
 
+        sz = self.sz
         wave_form = self.conv_synthesis_real(real) + self.conv_synthesis_imag(imag)
-        wave_form = wave_form[:, :, self.sz:-self.sz]
+        wave_form = wave_form[:, :, sz:-sz]
 
         return wave_form[:, 0, :]
 
-    #According to profiler py-spy, flip() uses more CPU than any other part of code (on large runs), e.g. 40%-70% of total usage.
-    #@staticmethod
-    #def flip(x, dim):
-    #    # https://github.com/pytorch/pytorch/issues/229
-    #    xsize = x.size()
-    #    dim = x.dim() + dim if dim < 0 else dim
-    #    x = x.view(-1, *xsize[dim:])
-    #    x = x.view(x.size(0), x.size(1), -1)[:, getattr(torch.arange(x.size(1) - 1,
-    #                                                                 -1, -1), ('cpu', 'cuda')[x.is_cuda])().long(),
-    #                                         :]
-    #    return x.view(xsize)
+    #According to profiler py-spy, the old index-based flip() used more CPU than any other
+    #part of code (on large runs), e.g. 40%-70% of total usage; native torch.flip replaced it.
     @staticmethod
     def flip(x, dim):
         return x.flip(dim)  # flip now in PyTorch, PR #7873 https://github.com/pytorch/pytorch/pull/7873
@@ -169,38 +228,53 @@ class FNNAnalysis(nn.Module):
         of the Front-End ('Fe').
     """
 
-    def __init__(self, ft_size=1024):
+    def __init__(self, ft_size=1024, use_bf16=False, trainable=True):
         super(FNNAnalysis, self).__init__()
 
         # Parameters
         self.batch_size = None
         self.time_domain_samples = None
         self.sz = ft_size
-        self.half_N = int(self.sz / 2 + 1)
+        self.half_N = self.sz // 2 + 1
+        self.use_bf16 = use_bf16 and hasattr(torch, 'bfloat16')
+        self.trainable = trainable
 
-        # Analysis
-        self.fnn_analysis_real = nn.Linear(self.sz, self.sz, bias=False)
-        self.fnn_analysis_imag = nn.Linear(self.sz, self.sz, bias=False)
+        # Analysis: real & imaginary bases stacked into one weight so forward is a single GEMM
+        self.fnn_analysis = nn.Linear(self.sz, 2*self.sz, bias=False)
 
         # Custom Initialization with Fourier matrix
         self.initialize()
 
-    def initialize(self):
-        f_matrix = np.fft.fft(np.eye(self.sz), norm='ortho')
+        if not trainable:
+            # fixed Fourier weights: no grad buffers, and optimizers will skip them
+            for p in self.parameters():
+                p.requires_grad_(False)
 
-        f_matrix_real = (np.real(f_matrix)).astype(np.float32, copy=False)
-        f_matrix_imag = (np.imag(f_matrix)).astype(np.float32, copy=False)
+        if self.use_bf16:
+            # the Fourier bases are fixed constants; bf16 halves the GEMM bandwidth
+            self.fnn_analysis.to(dtype=torch.bfloat16)
 
-        if torch.has_cudnn:
-            self.fnn_analysis_real.weight.data.copy_(torch.from_numpy(f_matrix_real).cuda())
-            self.fnn_analysis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag).cuda())
-        else:
-            self.fnn_analysis_real.weight.data.copy_(torch.from_numpy(f_matrix_real))
-            self.fnn_analysis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag))
+    def initialize(self):
+        f_matrix_real, f_matrix_imag = dft_matrices(self.sz)
+
+        self.fnn_analysis.weight.data.copy_(
+            torch.from_numpy(np.concatenate((f_matrix_real, f_matrix_imag), axis=0)))
 
     def forward(self, wave_form):
-        an_real = self.fnn_analysis_real(wave_form)[:, :, :self.half_N]
-        an_imag = self.fnn_analysis_imag(wave_form)[:, :, :self.half_N]
+        if not self.trainable:
+            with torch.no_grad():
+                return self._fnn_forward(wave_form)
+        return self._fnn_forward(wave_form)
+
+    def _fnn_forward(self, wave_form):
+        sz, half_N = self.sz, self.half_N
+        if self.use_bf16:
+            wave_form = wave_form.to(torch.bfloat16)
+        out = self.fnn_analysis(wave_form)          # one GEMM for both real & imag parts
+        an_real = out[:, :, :half_N]
+        an_imag = out[:, :, sz:sz + half_N]
+        if self.use_bf16:
+            return an_real.float(), an_imag.float()
 
         return an_real, an_imag
 
@@ -211,22 +285,27 @@ class FNNSynthesis(nn.Module):
         of the Front-End ('Fe').
     """
 
-    def __init__(self, ft_size=1024, random_init=False):
+    def __init__(self, ft_size=1024, random_init=False, use_bf16=False, trainable=True):
         super(FNNSynthesis, self).__init__()
 
         # Parameters
         self.batch_size = None
         self.time_domain_samples = None
         self.sz = ft_size
-        self.half_N = int(self.sz / 2 + 1)
+        self.half_N = self.sz // 2 + 1
+        self.use_bf16 = use_bf16 and hasattr(torch, 'bfloat16')
+        self.trainable = trainable
 
-        # Synthesis
-        self.fnn_synthesis_real = nn.Linear(self.sz, self.sz, bias=False)
-        self.fnn_synthesis_imag = nn.Linear(self.sz, self.sz, bias=False)
+        # Synthesis: real & imaginary bases side by side; forward feeds cat((real, imag))
+        # through one GEMM instead of two
+        self.fnn_synthesis = nn.Linear(2*self.sz, self.sz, bias=False)
 
         # Tanh
         self.tanh = torch.nn.Tanh()
 
+        # reversed bin indices for rebuilding the mirrored half of the spectrum
+        self.register_buffer('_rev_idx', torch.arange(self.half_N - 2, 0, -1, dtype=torch.long))
+
         if random_init:
             # Random Initialization
             self.initialize_random()
@@ -234,47 +313,46 @@ class FNNSynthesis(nn.Module):
             # Custom Initialization with Fourier matrix
             self.initialize()
 
-    def initialize(self):
-        print('Initializing with Fourier bases')
-        f_matrix = np.fft.fft(np.eye(self.sz), norm='ortho')
+        if not trainable:
+            # fixed Fourier weights: no grad buffers, and optimizers will skip them
+            for p in self.parameters():
+                p.requires_grad_(False)
 
-        f_matrix_real = (np.real(f_matrix)).astype(np.float32, copy=False)
-        f_matrix_imag = (np.imag(f_matrix)).astype(np.float32, copy=False)
+        if self.use_bf16:
+            # the Fourier bases are fixed constants; bf16 halves the GEMM bandwidth
+            self.fnn_synthesis.to(dtype=torch.bfloat16)
 
-        if torch.has_cudnn:
-            self.fnn_synthesis_real.weight.data.copy_(torch.from_numpy(f_matrix_real.T).cuda())
-            self.fnn_synthesis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag.T).cuda())
+    def initialize(self):
+        print('Initializing with Fourier bases')
+        f_matrix_real, f_matrix_imag = dft_matrices(self.sz)
 
-        else:
-            self.fnn_synthesis_real.weight.data.copy_(torch.from_numpy(f_matrix_real.T))
-            self.fnn_synthesis_imag.weight.data.copy_(torch.from_numpy(f_matrix_imag.T))
+        self.fnn_synthesis.weight.data.copy_(
+            torch.from_numpy(np.concatenate((f_matrix_real.T, f_matrix_imag.T), axis=1)))
 
     def initialize_random(self):
         print('Initializing randomly')
-        nn.init.xavier_uniform(self.fnn_synthesis_real.weight)
-        nn.init.xavier_uniform(self.fnn_synthesis_imag.weight)
+        nn.init.xavier_uniform(self.fnn_synthesis.weight)
 
     def forward(self, real, imag):
-        real = torch.cat((real, Synthesis.flip(real[:, :, 1:-1].contiguous(), 2)), 2)
-        imag = torch.cat((imag, Synthesis.flip(-imag[:, :, 1:-1].contiguous(), 2)), 2)
-
-        wave_form = self.fnn_synthesis_real(real) + self.fnn_synthesis_imag(imag)
+        if not self.trainable:
+            with torch.no_grad():
+                return self._fnn_forward(real, imag)
+        return self._fnn_forward(real, imag)
+
+    def _fnn_forward(self, real, imag):
+        # index_select mirrors the interior bins in one gather; neg_ runs in-place on the
+        # freshly gathered copy, so no '-imag' temporary is ever allocated
+        real = torch.cat((real, real.index_select(2, self._rev_idx)), 2)
+        imag = torch.cat((imag, imag.index_select(2, self._rev_idx).neg_()), 2)
+
+        spectra = torch.cat((real, imag), 2)    # one GEMM for both real & imag parts
+        if self.use_bf16:
+            return self.fnn_synthesis(spectra.to(torch.bfloat16)).float()
+
+        wave_form = self.fnn_synthesis(spectra)
         return wave_form
 
-    #@staticmethod
-    #def flip_old(x, dim):
-    #    # https://github.com/pytorch/pytorch/issues/229
-    #    xsize = x.size()
-    #    dim = x.dim() + dim if dim < 0 else dim
-    #    x = x.view(-1, *xsize[dim:])
-    #    x = x.view(x.size(0), x.size(1), -1)[:, getattr(torch.arange(x.size(1) - 1,
-    #                                         -1, -1), ('cpu', 'cuda')[x.is_cuda])().long(), :]
-    #    return x.view(xsize)
-
-    # Pytorch 0.4.0+ version of flip. slightly faster than flip_old
     @staticmethod
     def flip(x, dim):
-        indices = [slice(None)] * x.dim()
-        indices[dim] = torch.arange(x.size(dim) - 1, -1, -1, dtype=torch.long, device=x.device)
-        return x[tuple(indices)]
+        return x.flip(dim)  # single kernel; no reversed-arange index tensor needed
 # EOF
@@ -12,10 +12,15 @@ import numpy as np
 import torch
 import os
 import glob
+from concurrent.futures import ThreadPoolExecutor
 from torch.utils.data import Dataset
 from . import audio
 import sys
 import random
+import inspect
+
+# per-process generator (PCG64); reseeded per DataLoader worker in worker_init below
+_rng = np.random.default_rng()
 
 
 def do_augment(x, y, rand_invert=True, mult_some=False, add_some=False):
@@ -24,29 +29,32 @@ def do_augment(x, y, rand_invert=True, mult_some=False, add_some=False):
     Nothing fancy: Don't want to mess up the target data if this is a file-based dataset.
     Note that time translations are effectively already handled by the data generators (below).
     """
-    if rand_invert and np.random.choice([True,False]):
+    # one RNG call supplies all three coin flips, one bit each
+    bits = _rng.integers(0, 8)
+
+    if rand_invert and (bits & 1):
         # randomly flip phases of both input & target
         x, y = -x, -y
 
     # Below are ugmentations that only affect the lookback part of the input x
     lookback = x.size - y.size
 
-    if mult_some and np.random.choice([True,False]):
+    if mult_some and (bits & 2):
         # like "cutout" or "salt & pepper". here we randomly multiply isolated samples by random factors.
         # NOTE: this will end up adding lots of high-freq info in the STFT and may not be adviseable.
         fraction = 0.2 # mess with this fraction of number of samples in the lookback window
         n = int(lookback * fraction)                     # number of samples to modify
-        indices = np.random.randint(0, high=lookback, size=n) # indices where mod will occur
-        mults = (2*np.random.rand(n)-1).astype(x.dtype, copy=False)  # random multiplicative factor [-1..1]
-        x[indices] = x[indices] * mults
+        indices = _rng.choice(lookback, size=n, replace=False) # indices where mod will occur; unique, so the
+        mults = 2*_rng.random(n, dtype=np.float32)-1  # random multiplicative factor [-1..1], drawn f32 (no f64 temp)
+        x[indices] *= mults                           # in-place fancy multiply is well-defined
 
-    if add_some and np.random.choice([True,False]):
+    if add_some and (bits & 4):
         # similar to mult_some, but we add verrry small noise to some points
         fraction = 0.3
         n = int(lookback * fraction)                     # number of samples to modify
-        indices = np.random.randint(0, high=lookback, size=n)
-        tiny_fac = np.max(x) / 1e6
-        adds = ( tiny_fac*(2*np.random.rand(n)-1) ).astype(x.dtype, copy=False)
+        indices = _rng.integers(0, high=lookback, size=n)
+        tiny_fac = np.abs(x[:lookback]).max() / 1e6  # |.| so negative-dominant signals still give a sane scale
+        adds = tiny_fac*(2*_rng.random(n, dtype=np.float32)-1)
         x[indices] = x[indices] + adds
     return x, y
 
@@ -58,7 +66,10 @@ def worker_init(worker_id):
     Without this you get the same thing every epoch
     """
     # NOTE that this current implementation prevents strict reproducability
-    np.random.seed()
+    global _rng
+    np.random.seed()                      # legacy global state, for anything still on np.random.*
+    _rng = np.random.default_rng()        # fresh per-worker PCG64 stream (forked copies were identical)
+    audio._rng = np.random.default_rng()  # ditto for the generators in audio.py
 
 
 class AudioFileDataSet(Dataset):
@@ -76,6 +87,10 @@ class AudioFileDataSet(Dataset):
 
         self.chunk_size = chunk_size
         self.effect = effect  # The only reason we still need the effect defined (even though we're reading files) is to get the RANGES for the knobs
+        # knob normalization terms are fixed per dataset; precompute for get_single_chunk
+        kr = effect.knob_ranges
+        self._knob_lo = kr[:,0].astype(dtype)
+        self._knob_scale = (1.0/(kr[:,1]-kr[:,0])).astype(dtype)
         self.sr = sr
         self.path  = path
         self.dtype = dtype
@@ -90,6 +105,7 @@ class AudioFileDataSet(Dataset):
         self.augment = augment   # data augmentation: randomly invert phase
         self.processed_dir = ''
         self.num_knobs = 0
+        self._knob_cache = {}    # filename -> parsed knob array; see parse_knob_string
         '''
         # Loading raw audio files (".wav") is incredibly slow. Much fast to preprocess and save in another format
         check_preproc = False
@@ -131,10 +147,18 @@ class AudioFileDataSet(Dataset):
         self.x, self.y = [],[]
         #self.x = np.zeros((files_to_load,len(audio_in) ),dtype=self.dtype)
         #self.y = np.zeros((files_to_load,len(audio_targ) ),dtype=self.dtype)
-        self.knobs = np.zeros((files_to_load, self.num_knobs ),dtype=self.dtype)
+        # back the preloaded data with torch shared memory: forked DataLoader workers then
+        # map the same physical pages instead of copy-on-write duplicating the whole preload
+        knobs_t = torch.from_numpy(np.zeros((files_to_load, self.num_knobs), dtype=self.dtype))
+        knobs_t.share_memory_()
+        self.knobs = knobs_t.numpy()   # numpy view of the shared storage
         print_every = files_to_load//10 if 0!= files_to_load//10 else 1
+        # file reads release the GIL, so threads give near-linear preload speedup;
+        # results are consumed in submission order to keep x/y/knobs rows aligned
+        pool = ThreadPoolExecutor(max_workers=min(32, os.cpu_count() or 1))
+        futures = [pool.submit(self.read_one_new_file_pair, idx=i) for i in range(files_to_load)]
         for i in range(files_to_load):
-            tmp_x, tmp_y,  self.knobs[i] = self.read_one_new_file_pair(idx=i)
+            tmp_x, tmp_y,  self.knobs[i] = futures[i].result()
 
             if ((i+1) % print_every == 0) or (i+1 == files_to_load):
                 print("\r       i = ",i+1,"/",files_to_load," len x =",len(tmp_x), "dur=",len(tmp_x)/44100.0/60," min", " len y =",len(tmp_y))
@@ -152,10 +176,16 @@ class AudioFileDataSet(Dataset):
             if self.effect.is_inverse:
                 tmp_x, tmp_y = tmp_y, tmp_x         # for effects that reverse 'input' and 'output' (for de-____ effects)
 
-            # add audio to the lists that make up the datasets
-            self.x.append(tmp_x)
-            self.y.append(tmp_y)
+            # add audio to the lists that make up the datasets, moved into shared memory
+            # (keep numpy views so get_single_chunk's slicing code is unchanged)
+            tx = torch.from_numpy(np.ascontiguousarray(tmp_x))
+            ty = torch.from_numpy(np.ascontiguousarray(tmp_y))
+            tx.share_memory_()
+            ty.share_memory_()
+            self.x.append(tx.numpy())
+            self.y.append(ty.numpy())
 
+        pool.shutdown()
         print("    ...finished preloading")
 
     def __len__(self):
@@ -180,8 +210,11 @@ class AudioFileDataSet(Dataset):
             Nowhere else in the filename should double underscores appear.
             Example: 'target_9400_Compressor_4c__-10.95__3.428__0.005043__0.01308.wav'
         """
-        knob_list = knob_str.replace(ext,'').split('__')[1:] # strip ext, and throw out everything before first __'s
-        knobs = np.array([float(x) for x in knob_list], dtype=self.dtype)  # turn list of number-strings into float numpy array
+        knobs = self._knob_cache.get(knob_str)   # filenames never change, so parse each one once
+        if knobs is None:
+            knob_list = knob_str.replace(ext,'').split('__')[1:] # strip ext, and throw out everything before first __'s
+            knobs = np.array([float(x) for x in knob_list], dtype=self.dtype)  # turn list of number-strings into float numpy array
+            self._knob_cache[knob_str] = knobs
         return knobs
 
 
@@ -192,7 +225,7 @@ class AudioFileDataSet(Dataset):
             idx (optional): index within the list of filenames to read from
         """
         if idx is None:
-            idx = np.random.randint(0,high=len(self.input_filenames)) # pick a file at random
+            idx = _rng.integers(0,high=len(self.input_filenames)) # pick a file at random
 
         audio_in, sr = audio.read_audio_file(self.input_filenames[idx], sr=self.sr, fix_and_overwrite=True)
         audio_targ, sr = audio.read_audio_file(self.target_filenames[idx], sr=self.sr, fix_and_overwrite=True)
@@ -222,14 +255,17 @@ class AudioFileDataSet(Dataset):
         Grabs audio and knobs either from files or from preloaded buffer(s)
         """
         if self.preload:  # This will typically be the case
-            i = np.random.randint(0,high=len(self.x))  # pick a random line from preloaded audio
+            # one RNG call supplies both the line pick and the chunk start
+            r = _rng.integers(0, 1 << 30, size=2)
+            i = int(r[0]) % len(self.x)  # pick a random line from preloaded audio
             in_audio, targ_audio, knobs_wc = self.x[i], self.y[i], self.knobs[i]  # note these might be, e.g. 10 seconds long
         else:
             in_audio, targ_audio, knobs_wc = self.read_one_new_file_pair() # read x, y, knobs
+            r = None
 
         # Grab a random chunk from within total audio nfile
         assert len(in_audio) > self.chunk_size, f"Error: len(in_audio)={len(in_audio)}, must be > self.chunk_size={self.chunk_size}"
-        ibgn = np.random.randint(0, len(in_audio) - self.chunk_size)
+        ibgn = (int(r[1]) if r is not None else _rng.integers(0, 1 << 30)) % (len(in_audio) - self.chunk_size)
         x_item = in_audio[ibgn:ibgn+self.chunk_size]
         y_item = targ_audio[ibgn:ibgn+self.chunk_size]
 
@@ -238,9 +274,8 @@ class AudioFileDataSet(Dataset):
 
         y_item = y_item[-self.y_size:]   # Format for expected output size
 
-        # normalize knobs for nn usage
-        kr = self.effect.knob_ranges   # kr is abbribation for 'knob ranges'
-        knobs_nn = (knobs_wc - kr[:,0])/(kr[:,1]-kr[:,0]) - 0.5
+        # normalize knobs for nn usage (lo/scale precomputed in __init__)
+        knobs_nn = (knobs_wc - self._knob_lo)*self._knob_scale - 0.5
 
         if self.augment:
             x_item, y_item = do_augment(x_item, y_item)
@@ -285,13 +320,19 @@ class SynthAudioDataSet(Dataset):
 
         print("SynthAudioDataSet: synthetic/generated data")
 
+        # some effects' go_wc can write into a caller-supplied out= buffer
+        self._out_ok = 'out' in inspect.signature(effect.go_wc).parameters
+
         if recycle:  # keep the same data over & over (Useful for monitoring Validation set)
             print("Setting up recycling (static data) for this dataset. This may take a short while...")
             self.x = np.zeros((datapoints,chunk_size), dtype=self.dtype)
             self.y = np.zeros((datapoints,self.y_size ), dtype=self.dtype)
             self.knobs = np.zeros((datapoints, self.num_knobs), dtype=self.dtype)
+            # one scratch buffer for the effect output: safe here because each row
+            # is copied into self.x/self.y before the next chunk overwrites it
+            ybuf = np.empty(chunk_size, dtype=self.dtype) if self._out_ok else None
             for i in range(datapoints):
-                self.x[i], self.y[i], self.knobs[i] = self.gen_single_chunk()
+                self.x[i], self.y[i], self.knobs[i] = self.gen_single_chunk(out=ybuf)
             print("...done")
 
     def __len__(self):
@@ -304,22 +345,28 @@ class SynthAudioDataSet(Dataset):
         x, y, knobs = self.gen_single_chunk()
         return x.astype(self.dtype, copy=False)[-self.chunk_size:], y[-self.y_size:], knobs.astype(self.dtype, copy=False)
 
-    def gen_single_chunk(self, chooser=None, knobs=None):
+    def gen_single_chunk(self, chooser=None, knobs=None, out=None):
         """
         create a single time-series of input and target output, all with the same knobs setting
         """
         if chooser is None:
-            chooser = np.random.choice([0,1,2,4,6,7])  # for compressor
-            #chooser = np.random.choice([0,1,3,4,6,10,2,7,9]) # for compressor & more
+            chooser = _rng.choice([0,1,2,4,6,7])  # for compressor
+            #chooser = _rng.choice([0,1,3,4,6,10,2,7,9]) # for compressor & more
             #chooser = 4  # for just step response ('cheating')
             #chooser = np.random.choice([1,3,5,6,7])  # for echo
 
         x = audio.synth_input_sample(self.t, chooser)
+        # cast before the effect: the njit kernels specialize on dtype, and a float64 x
+        # with a float32 out= buffer cannot unify inside the compiled function
+        x = x.astype(self.dtype, copy=False)
 
         if knobs is None:
             knobs = audio.random_ends(len(self.effect.knob_ranges))-0.5  # inputs to NN, zero-mean...except we emphasize the ends slightly
 
-        y, x = self.effect.go(x, knobs)   # Apply the audio effect
+        if out is not None and self._out_ok:
+            y, x = self.effect.go(x, knobs, out=out)   # Apply the audio effect, writing into scratch
+        else:
+            y, x = self.effect.go(x, knobs)   # Apply the audio effect
 
         y = y[-self.y_size:]    # shrink output size
 
@@ -7,6 +7,8 @@ import numpy as np
 import wave as _wave
 from scipy.io.wavfile import write, read
 from sys import platform
+import matplotlib
+matplotlib.use('Agg')   # render straight to file; never spin up a GUI event loop from the training process
 import matplotlib.pylab as plt
 #from signaltrain.nn_modules import nn_proc
 
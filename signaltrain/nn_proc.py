@@ -256,21 +256,23 @@ class AsymMPAEC(nn.Module):
         self.phs_aenc = AsymAutoEncoder(T=expected_time_frames, R=decomposition_rank, K=n_knobs, OT=self.output_tf)
         #self.valve = nn.Parameter(torch.tensor([0.2,1.0]), requires_grad=True)  # "wet-dry mix"
 
+        # clip_grad_norm_ runs every optimizer step; build its parameter list once
+        self._clip_params = list(self.dft_analysis.parameters()) + list(self.dft_synthesis.parameters())
+
     def reinitialize(self):  # randomly reassigns weights
         self.aenc.initialize()
         self.phs_aenc.initialize()
 
     def clip_grad_norm_(self):
-        torch.nn.utils.clip_grad_norm_(list(self.dft_analysis.parameters()) +
-                                      list(self.dft_synthesis.parameters()),
-                                      max_norm=1., norm_type=1)
+        torch.nn.utils.clip_grad_norm_(self._clip_params, max_norm=1., norm_type=1)
 
 
     def forward(self, x_cuda, knobs_cuda):
         # trainable STFT, outputs spectrograms for real & imag parts
         x_real, x_imag = self.dft_analysis.forward(x_cuda/2)  # the /2 is cheap way to help us approach 'unit variaance' of -0.5 and .5
-        # Magnitude-Phase computation
-        mag = torch.norm(torch.cat((x_real.unsqueeze(0), x_imag.unsqueeze(0)), 0), 2, dim=0)
+        # Magnitude-Phase computation.  sqrt(re^2+im^2) directly; the old
+        # cat-then-norm allocated a doubled intermediate tensor every forward
+        mag = torch.sqrt(x_real*x_real + x_imag*x_imag)
         phs = torch.atan2(x_imag.float(), x_real.float()+1e-7).to(x_cuda.dtype)
         #print(f"  forward: mag.size = {mag.size()}")
 
@@ -25,6 +25,46 @@ except ImportError:
 
 
 
+class CudaPrefetcher():
+    """
+    Wraps a DataLoader so that each batch's host-to-device copies are issued on a
+    side CUDA stream while the previous batch is still computing, hiding the H2D
+    transfer behind the forward/backward pass.  Requires pin_memory=True on the
+    loader for the copies to be truly asynchronous.  Off-CUDA it just moves batches.
+    """
+    def __init__(self, dataloader, device):
+        self.dataloader, self.device = dataloader, device
+        self.use_cuda = (device.type == 'cuda')
+        self.stream = torch.cuda.Stream(device) if self.use_cuda else None
+
+    def __len__(self):
+        return len(self.dataloader)
+
+    def _preload(self, it):
+        try:
+            batch = next(it)
+        except StopIteration:
+            return None
+        with torch.cuda.stream(self.stream):
+            return [t.to(self.device, non_blocking=True) for t in batch]
+
+    def __iter__(self):
+        if not self.use_cuda:
+            for batch in self.dataloader:
+                yield [t.to(self.device) for t in batch]
+            return
+        it = iter(self.dataloader)
+        batch = self._preload(it)
+        while batch is not None:
+            # compute stream must wait for the copy; then batch tensors belong to it
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+            for t in batch:
+                t.record_stream(torch.cuda.current_stream(self.device))
+            next_batch = self._preload(it)
+            yield batch
+            batch = next_batch
+
+
 def eval_status_save(model, effect, epoch, epochs, lr, mom, device, dataloader_val, logfilename, first_time,
     beta, vl_avg, out_checkpointname, parallel, optimizer, data_point, smoothed_loss, y_size, sr, status_every,
     plot_every=10, cp_every=25, scale_by_freq=None):
@@ -38,17 +78,18 @@ def eval_status_save(model, effect, epoch, epochs, lr, mom, device, dataloader_v
     # Validation phase
     model.eval()
     val_batch_num = 0
-    for x_val, y_val, knobs_val in dataloader_val:
-        val_batch_num += 1
-        x_val_cuda, y_val_cuda, knobs_val_cuda = x_val.to(device), y_val.to(device), knobs_val.to(device)
-
-        y_val_hat, mag_val, mag_val_hat = model.forward(x_val_cuda, knobs_val_cuda)
-        loss_val = loss_functions.calc_loss(y_val_hat.float(), y_val_cuda.float(), mag_val_hat.float(),
-            scale_by_freq=scale_by_freq)#, l1_lambda=lr/1000 )
-        vl_avg = beta*vl_avg + (1-beta)*loss_val.item()    # (running) average val loss
-        if 0 == val_batch_num % status_every:
-            timediff = time.time() - first_time
-            print(f"\repoch {epoch+1}/{epochs}, time: {timediff:.2f}: lr={lr:.2e},mom={mom:.3f} data_point {data_point}: loss: {smoothed_loss:.3e} val_loss: {vl_avg:.3e}   ",end="")
+    with torch.no_grad():   # results are only reported, so skip the autograd tape & saved activations
+        for x_val, y_val, knobs_val in dataloader_val:
+            val_batch_num += 1
+            x_val_cuda, y_val_cuda, knobs_val_cuda = x_val.to(device), y_val.to(device), knobs_val.to(device)
+
+            y_val_hat, mag_val, mag_val_hat = model.forward(x_val_cuda, knobs_val_cuda)
+            loss_val = loss_functions.calc_loss(y_val_hat.float(), y_val_cuda.float(), mag_val_hat.float(),
+                scale_by_freq=scale_by_freq)#, l1_lambda=lr/1000 )
+            vl_avg = beta*vl_avg + (1-beta)*loss_val.item()    # (running) average val loss
+            if 0 == val_batch_num % status_every:
+                timediff = time.time() - first_time
+                print(f"\repoch {epoch+1}/{epochs}, time: {timediff:.2f}: lr={lr:.2e},mom={mom:.3f} data_point {data_point}: loss: {smoothed_loss:.3e} val_loss: {vl_avg:.3e}   ",end="")
 
     #  Write various forms of status output...
     with open(logfilename, "a") as myfile:  # save progress of val loss to text file
@@ -101,10 +142,7 @@ def train_loop(model, effect, device, optimizer, epochs, batch_size, lr_sched, m
 
         # Training phase
         model.train()
-        for x, y, knobs in dataloader:
-            # move to GPU TODO: does DataLoader already do this?
-            x_cuda, y_cuda, knobs_cuda = x.to(device), y.to(device), knobs.to(device)
-
+        for x_cuda, y_cuda, knobs_cuda in CudaPrefetcher(dataloader, device):
             lr = lr_sched[min(iter_count, len(lr_sched)-1)]  # get value for learning rate
             mom = mom_sched[min(iter_count, len(mom_sched)-1)]
             data_point += batch_size
@@ -237,8 +275,9 @@ def train(effect=audio.Compressor_4c(), epochs=100, n_data_points=200000, batch_
         dataset = datasets.AudioFileDataSet(chunk_size, effect, sr=sr,  datapoints=n_data_points, path=datapath+"/Train/",  y_size=out_chunk_size, rerun=(target_type!="stream"), augment=True, preload=True)
         dataset_val = datasets.AudioFileDataSet(chunk_size, effect, sr=sr, datapoints=n_data_points//4, path=datapath+"/Val/", y_size=out_chunk_size, rerun=(target_type!="stream"), augment=False)
 
-    dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=10, shuffle=True, worker_init_fn=datasets.worker_init) # need worker_init for more variance
-    dataloader_val = DataLoader(dataset_val, batch_size=batch_size, num_workers=10, shuffle=False)
+    # pin_memory lets the CudaPrefetcher's H2D copies run asynchronously
+    dataloader = DataLoader(dataset, batch_size=batch_size, num_workers=10, shuffle=True, worker_init_fn=datasets.worker_init, pin_memory=True) # need worker_init for more variance
+    dataloader_val = DataLoader(dataset_val, batch_size=batch_size, num_workers=10, shuffle=False, pin_memory=True)
 
 
 